@@ -3,12 +3,47 @@ AI-powered article summarizer (with mock mode for development)
 """
 import os
 import random
+import functools
 from dotenv import load_dotenv
 
 load_dotenv()
 
 MOCK_MODE = True  # Set to False when you have OpenAI credits
 
+# Mock templates - only the randomly chosen one gets formatted per call
+_SUMMARY_TEMPLATES = (
+    "Big news in {first_word}: This development could reshape the industry.",
+    "Analysis: {title}. Key insights for professionals following this space.",
+    "Breaking: {title}. What this means for the future of technology.",
+    "Update on {first_word}: Important implications for stakeholders.",
+    "Expert take: {title}. Why this matters right now."
+)
+
+_PERSONALIZATION_TEMPLATES = (
+    "Hey {interests_str} enthusiast! {summary}",
+    "Given your interest in {interests_str}: {summary}",
+    "Thought you'd like this as a {first_interest} follower: {summary}",
+    "Relevant to your {interests_str} interests: {summary}"
+)
+
+
+SUMMARY_CACHE_SIZE = 512  # Distinct articles remembered per process
+
+
+@functools.lru_cache(maxsize=SUMMARY_CACHE_SIZE)
+def _summarize(title, url, max_length, mock_mode):
+    """Summarize one article - cached process-wide, so a URL seen by any
+    user or any earlier run is never summarized twice"""
+    if mock_mode:
+        # Mock summaries for development
+        return random.choice(_SUMMARY_TEMPLATES).format(
+            first_word=title.split(None, 1)[0],
+            title=title
+        )
+    
+    # Real OpenAI code would go here
+    return f"Interesting development in {title.split(None, 1)[0]}... Read more at {url}"
+
 
 class ArticleSummarizer:
     def __init__(self):
@@ -18,33 +53,18 @@ class ArticleSummarizer:
         """
         Generate a concise summary of an article
         """
-        if self.mock_mode:
-            # Mock summaries for development
-            mock_summaries = [
-                f"Big news in {title.split()[0]}: This development could reshape the industry.",
-                f"Analysis: {title}. Key insights for professionals following this space.",
-                f"Breaking: {title}. What this means for the future of technology.",
-                f"Update on {title.split()[0]}: Important implications for stakeholders.",
-                f"Expert take: {title}. Why this matters right now."
-            ]
-            return random.choice(mock_summaries)
-        
-        # Real OpenAI code would go here
-        return f"Interesting development in {title.split()[0]}... Read more at {url}"
+        return _summarize(title, url, max_length, self.mock_mode)
     
     def personalize_summary(self, summary, user_interests):
         """
         Add personalization based on user interests
         """
         if self.mock_mode:
-            interests_str = " & ".join(user_interests[:2])
-            personalizations = [
-                f"Hey {interests_str} enthusiast! {summary}",
-                f"Given your interest in {interests_str}: {summary}",
-                f"Thought you'd like this as a {user_interests[0]} follower: {summary}",
-                f"Relevant to your {interests_str} interests: {summary}"
-            ]
-            return random.choice(personalizations)
+            return random.choice(_PERSONALIZATION_TEMPLATES).format(
+                interests_str=" & ".join(user_interests[:2]),
+                first_interest=user_interests[0],
+                summary=summary
+            )
         
         return summary
 
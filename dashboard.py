@@ -3,14 +3,17 @@ Streamlit Dashboard for Newsletter Analytics
 """
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
-import database
-from sqlalchemy.orm import sessionmaker
 import os
+import database
+from sqlalchemy import case, func, select
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 
 
 load_dotenv()
@@ -22,32 +25,197 @@ st.set_page_config(
     layout="wide"
 )
 
-# Database connection
+# Database connection - reuses the engine and connection pool that
+# database.py creates once at import instead of building a new engine
 def get_db_session():
-    engine = database.create_engine(os.getenv("DATABASE_URL"))
-    SessionLocal = sessionmaker(bind=engine)
-    return SessionLocal()
+    return database.SessionLocal()
 
-# Dashboard title
-st.title("📊 Newsletter Analytics Dashboard")
-st.markdown("Real-time insights into your newsletter performance")
 
-# Create tabs
-tab1, tab2, tab3, tab4 = st.tabs([
-    "📈 Overview", 
-    "👥 Subscribers", 
-    "📧 Campaigns", 
-    "📰 Content"
-])
+# Cached queries - Streamlit reruns the whole script on every widget
+# interaction, so results are memoized for a short TTL instead of
+# hitting the database each time. Plain DataFrames/tuples are returned
+# because ORM objects can't be cached.
+TRACKING_COLUMNS = [
+    "newsletter_id", "user_email", "sent_at",
+    "opened", "clicked", "opened_count", "click_count"
+]
 
-with tab1:
-    st.header("Performance Overview")
-    
+OPENED_FLAG = case((database.EmailTracking.opened == True, 1), else_=0)
+CLICKED_FLAG = case((database.EmailTracking.clicked == True, 1), else_=0)
+# Clicks from opened emails - the CTOR numerator
+OPENED_AND_CLICKED_FLAG = case(
+    ((database.EmailTracking.opened == True) & (database.EmailTracking.clicked == True), 1),
+    else_=0
+)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def load_subscribers():
+    """Subscribed users as an (email, interests) DataFrame shared by every tab"""
+    db = get_db_session()
+    try:
+        # Read-only, so select plain rows instead of full ORM objects
+        # One (email, interest) row per link, collapsed to one row per user
+        users = db.execute(
+            select(database.User.email, database.Interest.name)
+            .select_from(database.User)
+            .outerjoin(database.user_interests, database.user_interests.c.user_id == database.User.id)
+            .outerjoin(database.Interest, database.Interest.id == database.user_interests.c.interest_id)
+            .where(database.User.subscribed == True)
+            .order_by(database.User.id, database.user_interests.c.position)
+        ).all()
+        return (
+            pd.DataFrame(users, columns=["email", "interest"])
+            .groupby("email", sort=False)["interest"]
+            .agg(lambda names: ", ".join(names.dropna()))
+            .reset_index(name="interests")
+        )
+    finally:
+        db.close()
+
+
+def load_newsletter_ids():
+    """Every newsletter_id - only needed when simulating tracking events"""
+    db = get_db_session()
+    try:
+        return db.execute(select(database.EmailTracking.newsletter_id)).scalars().all()
+    finally:
+        db.close()
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def load_interest_counts():
+    """Subscribed users per interest, counted in SQL"""
+    db = get_db_session()
+    try:
+        subscribers = func.count(database.user_interests.c.user_id)
+        rows = db.execute(
+            select(database.Interest.name, subscribers)
+            .join(database.user_interests, database.user_interests.c.interest_id == database.Interest.id)
+            .join(database.User, database.User.id == database.user_interests.c.user_id)
+            .where(database.User.subscribed == True)
+            .group_by(database.Interest.name)
+            .order_by(subscribers.desc())
+        ).all()
+        return pd.Series(dict(rows), name="count", dtype="int64")
+    finally:
+        db.close()
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def load_recent_campaigns(limit=10):
+    """Most recently sent tracking records, newest first"""
+    db = get_db_session()
+    try:
+        # Let the database sort and limit rather than slicing the full table
+        rows = db.execute(
+            select(*(getattr(database.EmailTracking, column) for column in TRACKING_COLUMNS))
+            .order_by(database.EmailTracking.sent_at.desc())
+            .limit(limit)
+        ).all()
+        return pd.DataFrame(rows, columns=TRACKING_COLUMNS)
+    finally:
+        db.close()
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def load_totals():
+    """(sent, opened, clicked, opened_and_clicked) totals counted in SQL"""
+    db = get_db_session()
+    try:
+        total_sent, opened, clicked, opened_and_clicked = db.query(
+            func.count(database.EmailTracking.id),
+            func.coalesce(func.sum(OPENED_FLAG), 0),
+            func.coalesce(func.sum(CLICKED_FLAG), 0),
+            func.coalesce(func.sum(OPENED_AND_CLICKED_FLAG), 0)
+        ).one()
+        return total_sent, opened, clicked, opened_and_clicked
+    finally:
+        db.close()
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def load_daily_stats():
+    """Daily (date, opens, clicks) tuples grouped in SQL"""
     db = get_db_session()
+    try:
+        sent_date = func.date(func.coalesce(database.EmailTracking.sent_at, func.current_timestamp()))
+        daily_stats = db.query(
+            sent_date,
+            func.sum(OPENED_FLAG),
+            func.sum(CLICKED_FLAG)
+        ).group_by(sent_date).order_by(sent_date).all()
+        # Tuple of tuples so it can key build_engagement_fig's cache
+        return tuple(tuple(row) for row in daily_stats)
+    finally:
+        db.close()
+
+
+@st.cache_resource(show_spinner=False)
+def build_engagement_fig(daily_stats):
+    """
+    Build the opens/clicks line chart for a tuple of daily stats.
+    Cached so unchanged data reuses the same Figure across reruns.
+    """
+    dates, daily_opened, daily_clicked = zip(*daily_stats)
+    
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=dates,
+        y=daily_opened,
+        name='Opens',
+        line=dict(color='#4F46E5', width=3)
+    ))
+    fig.add_trace(go.Scatter(
+        x=dates,
+        y=daily_clicked,
+        name='Clicks',
+        line=dict(color='#10B981', width=3)
+    ))
+    
+    fig.update_layout(
+        title="Engagement Over Time",
+        xaxis_title="Date",
+        yaxis_title="Count",
+        hovermode='x unified',
+        template="plotly_white"
+    )
     
-    # Get data
-    users = db.query(database.User).filter(database.User.subscribed == True).all()
-    tracking = db.query(database.EmailTracking).all()
+    return fig
+
+
+def clear_tracking_cache():
+    """Drop cached tracking data after it changes"""
+    load_recent_campaigns.clear()
+    load_totals.clear()
+    load_daily_stats.clear()
+
+
+def simulate_tracking_events(base_url, newsletter_ids, max_workers=32):
+    """
+    Hit the open and click tracking endpoints for each newsletter.
+    Requests run concurrently over one keep-alive session.
+    """
+    with requests.Session() as session:
+        adapter = HTTPAdapter(pool_maxsize=max_workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        
+        def simulate(newsletter_id):
+            session.get(f"{base_url}/track/open/{newsletter_id}", timeout=2)
+            session.get(f"{base_url}/track/click/{newsletter_id}/1", timeout=2)
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # list() re-raises the first failure, e.g. API server not running
+            list(executor.map(simulate, newsletter_ids))
+
+
+# Each tab and the sidebar is a fragment, so a widget interaction only
+# reruns the fragment it belongs to instead of the whole dashboard
+@st.fragment
+def render_overview(users, total_sent, opened, clicked):
+    """Overview tab: headline metrics and engagement chart"""
+    st.header("Performance Overview")
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -59,14 +227,12 @@ with tab1:
         )
     
     with col2:
-        total_sent = len(tracking)
         st.metric(
             label="Newsletters Sent",
             value=total_sent
         )
     
     with col3:
-        opened = sum(1 for t in tracking if t.opened)
         open_rate = (opened / total_sent * 100) if total_sent > 0 else 0
         st.metric(
             label="Avg Open Rate",
@@ -75,7 +241,6 @@ with tab1:
         )
     
     with col4:
-        clicked = sum(1 for t in tracking if t.clicked)
         click_rate = (clicked / total_sent * 100) if total_sent > 0 else 0
         st.metric(
             label="Avg Click Rate",
@@ -84,80 +249,37 @@ with tab1:
         )
     
     # Recent activity chart
-    if tracking:
+    if total_sent:
         st.subheader("Recent Activity")
         
-        # Prepare data for chart
-        df_tracking = pd.DataFrame([{
-            'date': t.sent_at.date() if t.sent_at else datetime.now().date(),
-            'opened': 1 if t.opened else 0,
-            'clicked': 1 if t.clicked else 0
-        } for t in tracking])
+        # Daily opens/clicks grouped in the database
+        daily_stats = load_daily_stats()
         
-        if not df_tracking.empty:
-            daily_stats = df_tracking.groupby('date').agg({
-                'opened': 'sum',
-                'clicked': 'sum'
-            }).reset_index()
-            
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(
-                x=daily_stats['date'],
-                y=daily_stats['opened'],
-                name='Opens',
-                line=dict(color='#4F46E5', width=3)
-            ))
-            fig.add_trace(go.Scatter(
-                x=daily_stats['date'],
-                y=daily_stats['clicked'],
-                name='Clicks',
-                line=dict(color='#10B981', width=3)
-            ))
-            
-            fig.update_layout(
-                title="Engagement Over Time",
-                xaxis_title="Date",
-                yaxis_title="Count",
-                hovermode='x unified',
-                template="plotly_white"
-            )
-            
+        if daily_stats:
+            fig = build_engagement_fig(daily_stats)
             st.plotly_chart(fig, use_container_width=True)
-    
-    db.close()
 
-with tab2:
+
+@st.fragment
+def render_subscribers(users, interest_counts):
+    """Subscribers tab: subscriber table, interests and signup form"""
     st.header("Subscriber Management")
     
-    db = get_db_session()
-    users = db.query(database.User).filter(database.User.subscribed == True).all()
-    
-    if users:
+    if not users.empty:
         # Subscriber table
         st.subheader("Active Subscribers")
         
-        user_data = []
-        for user in users:
-            interests = user.interests.split(",") if user.interests else []
-            user_data.append({
-                "Email": user.email,
-                "Interests": ", ".join(interests),
-                "Subscribed Since": "Today"  # Would be actual date in production
-            })
-        
-        df_users = pd.DataFrame(user_data)
+        df_users = pd.DataFrame({
+            "Email": users["email"],
+            "Interests": users["interests"],
+            "Subscribed Since": "Today"  # Would be actual date in production
+        })
         st.dataframe(df_users, use_container_width=True)
         
         # Interests distribution
         st.subheader("Interest Distribution")
         
-        all_interests = []
-        for user in users:
-            if user.interests:
-                all_interests.extend([i.strip() for i in user.interests.split(",")])
-        
-        if all_interests:
-            interest_counts = pd.Series(all_interests).value_counts()
+        if not interest_counts.empty:
             fig = px.pie(
                 values=interest_counts.values,
                 names=interest_counts.index,
@@ -187,53 +309,50 @@ with tab2:
         if submitted and new_email:
             st.success(f"Subscriber {new_email} added successfully!")
             # In production, would call the API to add user
-    
-    db.close()
 
-with tab3:
+
+@st.fragment
+def render_campaigns(total_sent, opened, clicked, opened_and_clicked):
+    """Campaigns tab: recent newsletters and performance metrics"""
     st.header("Campaign Analytics")
     
-    db = get_db_session()
-    tracking = db.query(database.EmailTracking).all()
-    
-    if tracking:
+    if total_sent:
         # Campaign performance table
         st.subheader("Recent Newsletters")
         
-        campaign_data = []
-        for t in tracking[-10:]:  # Last 10 campaigns
-            campaign_data.append({
-                "Newsletter ID": t.newsletter_id[:8] + "...",
-                "Sent To": t.user_email,
-                "Sent Date": t.sent_at.strftime("%Y-%m-%d %H:%M") if t.sent_at else "N/A",
-                "Opened": "✅" if t.opened else "❌",
-                "Clicked": "✅" if t.clicked else "❌",
-                "Open Count": t.opened_count,
-                "Click Count": t.click_count
-            })
-        
-        df_campaigns = pd.DataFrame(campaign_data)
+        recent = load_recent_campaigns(10)  # Last 10 campaigns
+        df_campaigns = pd.DataFrame({
+            "Newsletter ID": recent["newsletter_id"].str.slice(0, 8) + "...",
+            "Sent To": recent["user_email"],
+            "Sent Date": pd.to_datetime(recent["sent_at"]).dt.strftime("%Y-%m-%d %H:%M").fillna("N/A"),
+            "Opened": np.where(recent["opened"], "✅", "❌"),
+            "Clicked": np.where(recent["clicked"], "✅", "❌"),
+            "Open Count": recent["opened_count"],
+            "Click Count": recent["click_count"]
+        })
         st.dataframe(df_campaigns, use_container_width=True)
         
         # Performance comparison
         st.subheader("Performance Metrics")
         
+        # CTOR only counts clicks from opened emails (counted in SQL)
         metrics_data = {
             "Metric": ["Open Rate", "Click Rate", "CTOR (Click-to-Open)"],
             "Value": [
-                f"{(sum(1 for t in tracking if t.opened)/len(tracking)*100):.1f}%",
-                f"{(sum(1 for t in tracking if t.clicked)/len(tracking)*100):.1f}%",
-                f"{(sum(1 for t in tracking if t.clicked)/sum(1 for t in tracking if t.opened)*100):.1f}%" if sum(1 for t in tracking if t.opened) > 0 else "0%"
+                f"{(opened/total_sent*100):.1f}%" if total_sent > 0 else "0%",
+                f"{(clicked/total_sent*100):.1f}%" if total_sent > 0 else "0%",
+                f"{(opened_and_clicked/opened*100):.1f}%" if opened > 0 else "0%"
             ],
             "Industry Avg": ["20-30%", "2-5%", "10-20%"]
         }
         
         df_metrics = pd.DataFrame(metrics_data)
         st.table(df_metrics)
-    
-    db.close()
 
-with tab4:
+
+@st.fragment
+def render_content():
+    """Content tab: popular articles and recommendations"""
     st.header("Content Performance")
     
     st.subheader("Most Popular Articles")
@@ -272,8 +391,10 @@ with tab4:
     for rec in recommendations:
         st.write(rec)
 
-# Sidebar
-with st.sidebar:
+
+@st.fragment
+def render_sidebar():
+    """Sidebar: quick actions and settings"""
     st.header("🚀 Quick Actions")
     
     if st.button("Send Test Newsletter", use_container_width=True):
@@ -284,16 +405,12 @@ with st.sidebar:
     
     if st.button("Simulate Test Data", use_container_width=True):
         try:
-            base_url = "http://localhost:8000"
-            db = get_db_session()
-            tracking = db.query(database.EmailTracking).all()
+            base_url = os.getenv("BASE_URL", "http://localhost:8000").rstrip("/")
+            newsletter_ids = load_newsletter_ids()
+            simulate_tracking_events(base_url, newsletter_ids)
             
-            for t in tracking:
-                requests.get(f"{base_url}/track/open/{t.newsletter_id}", timeout=2)
-                requests.get(f"{base_url}/track/click/{t.newsletter_id}/1", timeout=2)
-            
-            db.close()
-            st.success(f"Test data generated for {len(tracking)} newsletters! Refresh to see updates.")
+            clear_tracking_cache()
+            st.success(f"Test data generated for {len(newsletter_ids)} newsletters! Refresh to see updates.")
         except Exception as e:
             st.error(f"Error: {e}. Make sure API server is running (uvicorn main:app --reload)")
     
@@ -316,6 +433,41 @@ with st.sidebar:
     st.caption(f"Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     st.caption("Dashboard v1.0 | Newsletter System")
 
+
+# Dashboard title
+st.title("📊 Newsletter Analytics Dashboard")
+st.markdown("Real-time insights into your newsletter performance")
+
+# Load shared data once per rerun
+users = load_subscribers()
+
+# Count opens/clicks in SQL instead of iterating tracking rows
+total_sent, opened, clicked, opened_and_clicked = load_totals()
+
+# Create tabs
+tab1, tab2, tab3, tab4 = st.tabs([
+    "📈 Overview", 
+    "👥 Subscribers", 
+    "📧 Campaigns", 
+    "📰 Content"
+])
+
+with tab1:
+    render_overview(users, total_sent, opened, clicked)
+
+with tab2:
+    render_subscribers(users, load_interest_counts())
+
+with tab3:
+    render_campaigns(total_sent, opened, clicked, opened_and_clicked)
+
+with tab4:
+    render_content()
+
+# Sidebar
+with st.sidebar:
+    render_sidebar()
+
 # Footer
 st.divider()
 st.caption("Built with Streamlit | Connected to Newsletter API")
\ No newline at end of file
@@ -1,9 +1,9 @@
 """
 Database configuration and models for Newsletter System
 """
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Index, Table, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, relationship
 import os
 from dotenv import load_dotenv
 from datetime import datetime
@@ -13,18 +13,54 @@ load_dotenv()
 
 # Create database connection engine
 # Uses SQLite for simplicity, can swap for PostgreSQL later
-engine = create_engine(
-    os.getenv("DATABASE_URL"),
-    connect_args={"check_same_thread": False}  # SQLite specific
-)
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# pre_ping replaces connections dropped while the pool sat idle
+# (e.g. between daily newsletter runs)
+engine_options = {"pool_pre_ping": True}
+if DATABASE_URL.startswith("sqlite"):
+    engine_options["connect_args"] = {"check_same_thread": False}  # SQLite specific
+else:
+    engine_options["pool_size"] = 10
+    engine_options["max_overflow"] = 5
+
+engine = create_engine(DATABASE_URL, **engine_options)
 
 # Create session factory - each request gets its own session
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Objects stay loaded after commit, so reading them doesn't re-SELECT
+SessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=engine
+)
 
 # Base class for all models
 Base = declarative_base()
 
 
+# Many-to-many link between users and interests
+# Indexed on interest_id so per-interest counts are a single index scan
+# position keeps the order the user listed them in - the first interest
+# picks the subject line and only the first few are scraped
+user_interests = Table(
+    "user_interests",
+    Base.metadata,
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+    Column("interest_id", Integer, ForeignKey("interests.id", ondelete="CASCADE"), primary_key=True),
+    Column("position", Integer, nullable=False, default=0),
+    Index("ix_user_interests_interest_id", "interest_id"),
+)
+
+
+class Interest(Base):
+    """Topic a user can subscribe to (e.g. tech, business)"""
+    __tablename__ = "interests"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True, nullable=False)
+
+
 class User(Base):
     """
     User model representing newsletter subscribers
@@ -33,18 +69,38 @@ class User(Base):
 
     id = Column(Integer, primary_key=True, index=True)  # Auto-incrementing ID
     email = Column(String, unique=True, index=True)     # User's email (unique)
-    interests = Column(String)  # Comma-separated interests e.g., "tech,sports,business"
     subscribed = Column(Boolean, default=True)  # Subscription status
 
+    # Loaded with one extra SELECT ... IN query per batch of users (no N+1)
+    # Read-only: link rows are inserted with their position explicitly
+    interests = relationship(
+        "Interest",
+        secondary=user_interests,
+        lazy="selectin",
+        order_by=user_interests.c.position,
+        viewonly=True
+    )
+
+    @property
+    def interest_names(self):
+        """Interest names as a list of strings"""
+        return [interest.name for interest in self.interests]
+
 
 class EmailTracking(Base):
     """Tracks email opens and clicks for analytics"""
     __tablename__ = "email_tracking"
+    __table_args__ = (
+        # Dashboard groups by send date and counts opens/clicks
+        Index("ix_tracking_sent_opened", "sent_at", "opened"),
+        Index("ix_tracking_sent_clicked", "sent_at", "clicked"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_email = Column(String, index=True)  # Who received email
     newsletter_id = Column(String, unique=True, index=True)  # Unique ID for tracking
     sent_at = Column(DateTime, default=datetime.utcnow)
+    delivered = Column(Boolean, default=True)  # False if the send failed - retry candidate
     
     opened = Column(Boolean, default=False)
     opened_at = Column(DateTime, nullable=True)
@@ -53,7 +109,21 @@ class EmailTracking(Base):
     clicked = Column(Boolean, default=False)
     click_count = Column(Integer, default=0)
     last_clicked_at = Column(DateTime, nullable=True)
-    clicked_articles = Column(String, default="")  # Which articles clicked
+
+
+class EmailTrackingClick(Base):
+    """One row per link click - which article in which newsletter"""
+    __tablename__ = "email_tracking_clicks"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    newsletter_id = Column(
+        String,
+        ForeignKey("email_tracking.newsletter_id", ondelete="CASCADE"),
+        index=True,
+        nullable=False
+    )
+    article_index = Column(Integer, nullable=False)  # 1-based position in the email
+    clicked_at = Column(DateTime, default=datetime.utcnow)
 
 
 # Create all tables in the database
@@ -6,16 +6,217 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
+import jinja2
 import uuid
+import hmac
+import base64
+import hashlib
+from urllib.parse import quote
+import time
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
 USE_RESEND = False  # Set True when you get Resend API key
 
+# SMTP connection pool limits
+SMTP_MAX_CONNS_PER_HOST = 3      # Concurrent connections to the relay
+SMTP_MAX_USES_PER_CONN = 100     # Rotate before providers' per-connection caps
+SMTP_MAX_CONN_AGE = 5 * 60       # Seconds before a connection is rebuilt
+
+# Public URL of the API that serves tracking/unsubscribe links
+BASE_URL = os.getenv("BASE_URL", "http://localhost:8000").rstrip("/")
+
+# Signs unsubscribe links so they can't be forged for other addresses.
+# Without it, emails are sent with no unsubscribe link.
+UNSUBSCRIBE_SECRET = os.getenv("UNSUBSCRIBE_SECRET", "")
+
+# Newsletter layout - compiled once at import, autoescaped on render so
+# article titles/summaries and recipient data cannot inject markup
+_NEWSLETTER_TEMPLATE = jinja2.Environment(
+    autoescape=True,
+    trim_blocks=True,
+    lstrip_blocks=True,
+).from_string("""\
+<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+        .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+        .header { background: #4F46E5; color: white; padding: 20px; text-align: center; }
+        .article { margin: 20px 0; padding: 15px; border-left: 4px solid #4F46E5; background: #f9f9f9; }
+        .title { font-size: 18px; font-weight: bold; color: #1F2937; }
+        .summary { margin: 10px 0; color: #4B5563; }
+        .read-more { color: #4F46E5; text-decoration: none; }
+        .footer { margin-top: 30px; padding-top: 20px; border-top: 1px solid #E5E7EB; color: #6B7280; font-size: 12px; text-align: center; }
+    </style>
+</head>
+<body>
+    {% if newsletter_id %}
+    <!-- Tracking pixel for opens -->
+    <img src="{{ base_url }}/track/open/{{ newsletter_id | urlencode }}"
+         width="1" height="1" style="display:none; border:0;" alt="">
+    {% endif %}
+    <div class="container">
+        <div class="header">
+            <h1>📰 Your Personalized Newsletter</h1>
+            <p>Curated based on your interests: {{ interests | join(", ") }}</p>
+        </div>
+        {% for article in articles %}
+        <div class="article">
+            <div class="title">#{{ loop.index }}: {{ article["title"] }}</div>
+            <div class="summary">{{ article["summary"] }}</div>
+            <a href="{{ click_prefix ~ loop.index if click_prefix else article["url"] }}" class="read-more" target="_blank">Read full article →</a>
+        </div>
+        {% endfor %}
+        <div class="footer">
+            <p>You received this email because you subscribed to our newsletter.</p>
+            {% if unsubscribe_url %}
+            <p><a href="{{ unsubscribe_url }}">Unsubscribe</a></p>
+            {% endif %}
+            <p>© 2024 Newsletter System. All rights reserved.</p>
+        </div>
+    </div>
+</body>
+</html>
+""")
+
+
+def _sign(payload):
+    return hmac.new(UNSUBSCRIBE_SECRET.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+
+def make_unsubscribe_token(email):
+    """Signed token identifying email, for unsubscribe links"""
+    payload = base64.urlsafe_b64encode(email.encode()).decode()
+    return f"{payload}.{_sign(payload)}"
+
+
+def read_unsubscribe_token(token):
+    """Email address a token was issued for, or None if it's invalid"""
+    if not UNSUBSCRIBE_SECRET:
+        return None
+    
+    payload, _, signature = token.rpartition(".")
+    if not payload or not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    
+    try:
+        return base64.urlsafe_b64decode(payload.encode()).decode()
+    except ValueError:
+        return None
+
+
+class SMTPPool:
+    """
+    Bounded, thread-safe pool of authenticated SMTP connections, kept
+    per host so sends grouped by destination reuse warm connections.
+    Idle connections are health-checked with NOOP on checkout and
+    rebuilt once they reach max_uses messages or max_age seconds.
+    """
+    
+    def __init__(self, host, port, username, password,
+                 max_conns=SMTP_MAX_CONNS_PER_HOST,
+                 max_uses=SMTP_MAX_USES_PER_CONN,
+                 max_age=SMTP_MAX_CONN_AGE):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_conns = max_conns
+        self.max_uses = max_uses
+        self.max_age = max_age
+        
+        # Per host: idle connections as (smtp, uses, created_at) tuples,
+        # and a semaphore capping connections checked out at once
+        self._idle = {}
+        self._slots = {}
+        self._hosts_lock = threading.Lock()
+    
+    @contextmanager
+    def acquire(self, host=None):
+        """
+        Check out a healthy connection to host (default: the relay),
+        blocking while all of that host's connections are in use.
+        It goes back to the pool on exit, or is closed if the body raised.
+        """
+        host = host or self.host
+        idle, slots = self._host_pool(host)
+        with slots:
+            smtp, uses, created_at = self._checkout(host, idle)
+            try:
+                yield smtp
+            except Exception:
+                # Connection state unknown after a failure - don't reuse it
+                self._close(smtp)
+                raise
+            idle.put((smtp, uses + 1, created_at))
+    
+    def close(self):
+        """Close all idle connections for every host"""
+        with self._hosts_lock:
+            idle_queues = list(self._idle.values())
+        
+        for idle in idle_queues:
+            while True:
+                try:
+                    smtp, uses, created_at = idle.get_nowait()
+                except queue.Empty:
+                    break
+                self._close(smtp)
+    
+    def _host_pool(self, host):
+        """Idle queue and slot semaphore for host, created on first use"""
+        with self._hosts_lock:
+            if host not in self._idle:
+                self._idle[host] = queue.Queue()
+                self._slots[host] = threading.BoundedSemaphore(self.max_conns)
+            return self._idle[host], self._slots[host]
+    
+    def _checkout(self, host, idle):
+        """Reuse an idle connection if one is still good, otherwise connect"""
+        while True:
+            try:
+                smtp, uses, created_at = idle.get_nowait()
+            except queue.Empty:
+                return self._connect(host), 0, time.monotonic()
+            
+            if uses >= self.max_uses or time.monotonic() - created_at > self.max_age:
+                self._close(smtp)
+                continue
+            
+            try:
+                smtp.noop()
+                return smtp, uses, created_at
+            except Exception:
+                self._close(smtp)
+    
+    def _connect(self, host):
+        """Open and authenticate a new SMTP connection"""
+        smtp = smtplib.SMTP(host, self.port)
+        try:
+            smtp.starttls()
+            smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+    
+    def _close(self, smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
 
 class EmailSender:
-    def __init__(self):
+    def __init__(self, smtp_pool=None):
         self.use_resend = USE_RESEND
+        self.smtp_pool = None
         
         if self.use_resend:
             # For Resend API (better deliverability)
@@ -28,6 +229,30 @@ class EmailSender:
             self.smtp_username = os.getenv("SMTP_USERNAME", "")
             self.smtp_password = os.getenv("SMTP_PASSWORD", "")
             self.from_email = self.smtp_username
+            
+            # Connections are opened lazily, so this is free in dev mode
+            self.smtp_pool = smtp_pool or SMTPPool(
+                self.smtp_server, self.smtp_port,
+                self.smtp_username, self.smtp_password
+            )
+        
+        # Nesting depth of `with sender:` blocks; pooled connections
+        # stay open until the outermost one exits
+        self._session_depth = 0
+        self._session_lock = threading.Lock()
+    
+    def __enter__(self):
+        """Keep pooled SMTP connections open across sends until __exit__"""
+        with self._session_lock:
+            self._session_depth += 1
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        with self._session_lock:
+            self._session_depth -= 1
+            if self._session_depth == 0 and self.smtp_pool is not None:
+                self.smtp_pool.close()
+        return False
     
     def send_newsletter(self, to_email, subject, html_content, plain_text="", newsletter_id=None):
         """
@@ -38,49 +263,127 @@ class EmailSender:
         if not newsletter_id:
             newsletter_id = str(uuid.uuid4())[:8]  # First 8 chars of UUID
         
-        if self.use_resend:
-            success = self._send_via_resend(to_email, subject, html_content, newsletter_id)
-        else:
-            success = self._send_via_smtp(to_email, subject, html_content, plain_text, newsletter_id)
+        success = self.send_batch([(to_email, subject, html_content, plain_text, newsletter_id)])[0]
         
         return success, newsletter_id
     
-    def _send_via_smtp(self, to_email, subject, html_content, plain_text="", newsletter_id=""):
-        """Send email using SMTP (for development)"""
+    def send_batch(self, messages):
+        """
+        Send several emails, reusing one SMTP connection for the whole batch
+        messages: list of (to_email, subject, html_content, plain_text, newsletter_id)
+        Returns list of success flags in the same order
+        """
+        if self.use_resend:
+            return [
+                self._send_via_resend(to_email, subject, html_content, newsletter_id)
+                for to_email, subject, html_content, plain_text, newsletter_id in messages
+            ]
+        
         # Debug: Show what credentials we have
         print(f"   🔍 SMTP Check: username='{self.smtp_username}', password present={bool(self.smtp_password)}")
         
         # Check if we have SMTP credentials
         if not self.smtp_username or not self.smtp_password:
-            print(f"📧 [DEV MODE] Would send to {to_email}: {subject[:50]}...")
-            print(f"   Newsletter ID: {newsletter_id}")
+            for to_email, subject, html_content, plain_text, newsletter_id in messages:
+                print(f"📧 [DEV MODE] Would send to {to_email}: {subject[:50]}...")
+                print(f"   Newsletter ID: {newsletter_id}")
             print(f"   Set SMTP_USERNAME and SMTP_PASSWORD in .env to actually send")
-            return True  # Return True in dev mode
+            return [True] * len(messages)  # Return True in dev mode
+        
+        results = []
+        # Pooled connections stay open until the batch (or outer `with`) ends
+        with self:
+            try:
+                for to_email, subject, html_content, plain_text, newsletter_id in messages:
+                    results.append(self._send_via_smtp(to_email, subject, html_content, plain_text))
+            except Exception as e:
+                # Couldn't open/authenticate a connection - the rest would fail too
+                print(f"❌ SMTP connection failed: {e}")
+        
+        # Anything not attempted because the connection failed counts as failed
+        return results + [False] * (len(messages) - len(results))
+    
+    def send_newsletters_parallel(self, batch, workers=8):
+        """
+        Send many newsletters concurrently, splitting them across up to
+        `workers` threads. Each thread checks connections out of the SMTP
+        pool, so over SMTP workers is capped at the pool's per-host limit -
+        extra threads would only block waiting for a connection.
+        batch: list of (to_email, subject, html_content, plain_text, newsletter_id)
+        Returns list of (success, newsletter_id) tuples in the same order
+        """
+        # Generate IDs up front so results line up with send_newsletter's
+        messages = [
+            (to_email, subject, html_content, plain_text, newsletter_id or str(uuid.uuid4())[:8])
+            for to_email, subject, html_content, plain_text, newsletter_id in batch
+        ]
+        if not messages:
+            return []
+        
+        # Bounded pool keeps concurrent connections under provider rate limits
+        if self.smtp_pool is not None:
+            workers = min(workers, self.smtp_pool.max_conns)
+        workers = max(1, min(workers, len(messages)))
+        chunk_size = -(-len(messages) // workers)  # Ceiling division
+        chunks = [messages[i:i + chunk_size] for i in range(0, len(messages), chunk_size)]
+        
+        # Workers share the pool's connections, checked out per message
+        with self, ThreadPoolExecutor(max_workers=workers) as executor:
+            results = [success for chunk in executor.map(self.send_batch, chunks) for success in chunk]
         
+        return [(success, message[4]) for success, message in zip(results, messages)]
+    
+    def _build_msg(self, to_email, subject, html_content, plain_text=""):
+        """Build the multipart (plain + HTML) message"""
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = self.from_email
+        msg['To'] = to_email
+        
+        # Add both plain text and HTML versions
+        if plain_text:
+            msg.attach(MIMEText(plain_text, 'plain'))
+        msg.attach(MIMEText(html_content, 'html'))
+        
+        return msg
+    
+    def _send_via_smtp(self, to_email, subject, html_content, plain_text=""):
+        """
+        Send one email over a pooled SMTP connection.
+        Errors opening a connection propagate so send_batch can stop early.
+        """
+        # Serialized once - a retry resends the same bytes. Keeps the
+        # message's compat32 header encoding (RFC 2047 for non-ASCII) but
+        # with CRLF line endings, which sendmail doesn't add for bytes
         try:
-            # Create message
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = self.from_email
-            msg['To'] = to_email
-            
-            # Add both plain text and HTML versions
-            if plain_text:
-                msg.attach(MIMEText(plain_text, 'plain'))
-            msg.attach(MIMEText(html_content, 'html'))
-            
-            # Connect and send
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_username, self.smtp_password)
-                server.send_message(msg)
-            
-            print(f"✅ Email sent to {to_email}")
-            return True
-            
+            msg = self._build_msg(to_email, subject, html_content, plain_text)
+            raw = msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
         except Exception as e:
-            print(f"❌ Failed to send email to {to_email}: {e}")
+            # A bad message fails alone, not as a connection error for the batch
+            print(f"❌ Failed to build email to {to_email}: {e}")
             return False
+        
+        for attempt in range(2):
+            # Checked out per message so use/age limits apply per email.
+            # Everything goes through the one relay for now; direct-to-MX
+            # delivery would pass the recipient domain's MX host here
+            with self.smtp_pool.acquire(self.smtp_server) as server:
+                try:
+                    server.sendmail(self.from_email, [to_email], raw)
+                    
+                    print(f"✅ Email sent to {to_email}")
+                    return True
+                    
+                except smtplib.SMTPServerDisconnected as e:
+                    # Dropped after the health check - retry once, the pool
+                    # discards this connection on its next NOOP
+                    error = e
+                except Exception as e:
+                    print(f"❌ Failed to send email to {to_email}: {e}")
+                    return False
+        
+        print(f"❌ Failed to send email to {to_email}: {error}")
+        return False
     
     def _send_via_resend(self, to_email, subject, html_content, newsletter_id=""):
         """Send email using Resend API (production)"""
@@ -89,72 +392,26 @@ class EmailSender:
         print(f"   Newsletter ID: {newsletter_id}")
         return True
     
-    def create_newsletter_html(self, articles, user_interests, newsletter_id=""):
+    def create_newsletter_html(self, articles, user_interests, newsletter_id="", email=""):
         """
         Generate HTML email content from articles with tracking
+        Every article must have a 'url' (checked when articles are fetched)
         """
-        interests_str = ", ".join(user_interests)
-        
-        # Build tracking URLs if newsletter_id provided
-        tracking_pixel = ""
-        if newsletter_id:
-            tracking_pixel = f"""
-            <!-- Tracking pixel for opens -->
-            <img src="http://localhost:8000/track/open/{newsletter_id}" 
-                 width="1" height="1" style="display:none; border:0;" alt="">
-            """
-        
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: #4F46E5; color: white; padding: 20px; text-align: center; }}
-                .article {{ margin: 20px 0; padding: 15px; border-left: 4px solid #4F46E5; background: #f9f9f9; }}
-                .title {{ font-size: 18px; font-weight: bold; color: #1F2937; }}
-                .summary {{ margin: 10px 0; color: #4B5563; }}
-                .read-more {{ color: #4F46E5; text-decoration: none; }}
-                .footer {{ margin-top: 30px; padding-top: 20px; border-top: 1px solid #E5E7EB; color: #6B7280; font-size: 12px; text-align: center; }}
-            </style>
-        </head>
-        <body>
-            {tracking_pixel}
-            <div class="container">
-                <div class="header">
-                    <h1>📰 Your Personalized Newsletter</h1>
-                    <p>Curated based on your interests: {interests_str}</p>
-                </div>
-        """
+        # Loop-invariant part of each article's click-tracking URL
+        click_prefix = f"{BASE_URL}/track/click/{quote(newsletter_id, safe='')}/" if newsletter_id else ""
         
-        for i, article in enumerate(articles, 1):
-            # Create tracking URL for clicks
-            if newsletter_id:
-                click_url = f"http://localhost:8000/track/click/{newsletter_id}/{i}"
-            else:
-                click_url = article.get('url', 'https://example.com')
-            
-            html += f"""
-                <div class="article">
-                    <div class="title">#{i}: {article['title']}</div>
-                    <div class="summary">{article['summary']}</div>
-                    <a href="{click_url}" class="read-more" target="_blank">Read full article →</a>
-                </div>
-            """
-        
-        html += """
-                <div class="footer">
-                    <p>You received this email because you subscribed to our newsletter.</p>
-                    <p><a href="http://localhost:8000/unsubscribe/{email}">Unsubscribe</a></p>
-                    <p>© 2024 Newsletter System. All rights reserved.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        unsubscribe_url = ""
+        if email and UNSUBSCRIBE_SECRET:
+            unsubscribe_url = f"{BASE_URL}/unsubscribe?token={quote(make_unsubscribe_token(email))}"
         
-        return html
+        return _NEWSLETTER_TEMPLATE.render(
+            articles=articles,
+            interests=user_interests,
+            newsletter_id=newsletter_id,
+            click_prefix=click_prefix,
+            unsubscribe_url=unsubscribe_url,
+            base_url=BASE_URL,
+        )
 
 
 # Test
@@ -1,17 +1,26 @@
 """
 Main FastAPI application for Newsletter System
 """
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
+from sqlalchemy import select, update, func, case
 from sqlalchemy.orm import Session
 import database
 from pydantic import BaseModel
 from typing import List
 from datetime import datetime
-from fastapi.responses import Response, RedirectResponse
+from fastapi.responses import Response, RedirectResponse, HTMLResponse
+from email_sender import read_unsubscribe_token
+from urllib.parse import quote
+import html
 
 # Initialize FastAPI app
 app = FastAPI(title="Newsletter API", version="2.0.0")
 
+# 1x1 transparent GIF served for open tracking
+_PIXEL = b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00\x21\xf9\x04\x01\x00\x00\x00\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02\x44\x01\x00\x3b'
+# no-store so every open reaches us instead of a proxy cache
+_PIXEL_RESPONSE_HEADERS = {"Cache-Control": "no-store", "Content-Type": "image/gif"}
+
 
 def get_db():
     """
@@ -25,6 +34,26 @@ def get_db():
         db.close()
 
 
+def get_or_create_interests(db: Session, names: List[str]):
+    """
+    Look up Interest rows by name, creating any that don't exist yet.
+    Names are stripped and de-duplicated; blanks are ignored.
+    """
+    names = list(dict.fromkeys(name.strip() for name in names if name.strip()))
+    if not names:
+        return []
+    
+    existing = db.query(database.Interest).filter(database.Interest.name.in_(names)).all()
+    by_name = {interest.name: interest for interest in existing}
+    
+    for name in names:
+        if name not in by_name:
+            by_name[name] = database.Interest(name=name)
+            db.add(by_name[name])
+    
+    return [by_name[name] for name in names]
+
+
 class UserCreate(BaseModel):
     """Request model for creating a user"""
     email: str
@@ -48,9 +77,6 @@ def subscribe_user(user: UserCreate, db: Session = Depends(get_db)):
     """
     Subscribe a new user to newsletter
     """
-    # Convert interests list to comma-separated string
-    interests_str = ",".join(user.interests)
-    
     # Check if user already exists
     existing_user = db.query(database.User).filter(database.User.email == user.email).first()
     if existing_user:
@@ -59,11 +85,20 @@ def subscribe_user(user: UserCreate, db: Session = Depends(get_db)):
     # Create new user
     db_user = database.User(
         email=user.email,
-        interests=interests_str,
         subscribed=True
     )
-    
     db.add(db_user)
+    
+    interests = get_or_create_interests(db, user.interests)
+    db.flush()  # Assigns user/interest ids for the link rows
+    
+    # Link interests in the order the user gave them
+    if interests:
+        db.execute(database.user_interests.insert(), [
+            {"user_id": db_user.id, "interest_id": interest.id, "position": position}
+            for position, interest in enumerate(interests)
+        ])
+    
     db.commit()
     db.refresh(db_user)
     
@@ -74,7 +109,15 @@ def subscribe_user(user: UserCreate, db: Session = Depends(get_db)):
 def get_users(db: Session = Depends(get_db)):
     """Get all subscribed users"""
     users = db.query(database.User).filter(database.User.subscribed == True).all()
-    return users
+    return [
+        {
+            "id": u.id,
+            "email": u.email,
+            "interests": u.interest_names,
+            "subscribed": u.subscribed
+        }
+        for u in users
+    ]
 
 
 @app.post("/unsubscribe/{email}")
@@ -90,45 +133,106 @@ def unsubscribe_user(email: str, db: Session = Depends(get_db)):
     return {"message": "Unsubscribed successfully"}
 
 
-@app.get("/track/open/{newsletter_id}")
-def track_email_open(newsletter_id: str, db: Session = Depends(get_db)):
-    """Track when email is opened (via invisible pixel)"""
-    tracking = db.query(database.EmailTracking).filter(
-        database.EmailTracking.newsletter_id == newsletter_id
-    ).first()
+def _email_from_token(token: str):
+    """Email address from a signed unsubscribe token, or 400"""
+    email = read_unsubscribe_token(token)
+    if not email:
+        raise HTTPException(status_code=400, detail="Invalid unsubscribe link")
+    return email
+
+
+@app.get("/unsubscribe", response_class=HTMLResponse)
+def confirm_unsubscribe(token: str):
+    """
+    Landing page for the newsletter's unsubscribe link.
+    Only asks for confirmation - link scanners and prefetchers issue
+    GETs, so the actual unsubscribe is the form's POST.
+    """
+    email = _email_from_token(token)
+    return f"""<html><body>
+<p>Unsubscribe <b>{html.escape(email)}</b> from the newsletter?</p>
+<form method="post" action="/unsubscribe?token={quote(token)}">
+    <button type="submit">Unsubscribe</button>
+</form>
+</body></html>"""
+
+
+@app.post("/unsubscribe", response_class=HTMLResponse)
+def unsubscribe_with_token(token: str, db: Session = Depends(get_db)):
+    """Unsubscribe the address a signed unsubscribe token was issued for"""
+    email = _email_from_token(token)
     
-    if tracking:
-        tracking.opened = True
-        tracking.opened_count += 1
-        if not tracking.opened_at:
-            tracking.opened_at = datetime.utcnow()
-        db.commit()
-        print(f"📊 Email opened: {newsletter_id}")
+    db.execute(
+        update(database.User)
+        .where(database.User.email == email)
+        .values(subscribed=False)
+    )
+    db.commit()
     
-    # Return 1x1 transparent GIF pixel
-    pixel = b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00\x21\xf9\x04\x01\x00\x00\x00\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02\x44\x01\x00\x3b'
-    return Response(content=pixel, media_type="image/gif")
+    return f"<html><body><p>{html.escape(email)} has been unsubscribed.</p></body></html>"
+
+
+def _record_open(newsletter_id: str):
+    """
+    Mark a newsletter as opened. Runs after the pixel has been sent,
+    so it uses its own session and a single UPDATE statement.
+    """
+    db = database.SessionLocal()
+    try:
+        tracking = database.EmailTracking
+        result = db.execute(
+            update(tracking)
+            .where(tracking.newsletter_id == newsletter_id)
+            .values(
+                opened=True,
+                opened_count=tracking.opened_count + 1,
+                opened_at=func.coalesce(tracking.opened_at, datetime.utcnow())
+            )
+        )
+        db.commit()
+        if result.rowcount:
+            print(f"📊 Email opened: {newsletter_id}")
+        else:
+            print(f"⚠️  Open for unknown newsletter: {newsletter_id}")
+    finally:
+        db.close()
+
+
+@app.get("/track/open/{newsletter_id}")
+def track_email_open(newsletter_id: str, bg: BackgroundTasks):
+    """Track when email is opened (via invisible pixel)"""
+    # Respond immediately; the DB write happens after the response
+    bg.add_task(_record_open, newsletter_id)
+    return Response(content=_PIXEL, headers=_PIXEL_RESPONSE_HEADERS)
 
 
 @app.get("/track/click/{newsletter_id}/{article_index}")
 def track_link_click(newsletter_id: str, article_index: int, db: Session = Depends(get_db)):
     """Track when links are clicked in newsletter"""
-    tracking = db.query(database.EmailTracking).filter(
-        database.EmailTracking.newsletter_id == newsletter_id
-    ).first()
+    tracking = database.EmailTracking
+    
+    # Bump counters in place - no SELECT, no lost updates
+    result = db.execute(
+        update(tracking)
+        .where(tracking.newsletter_id == newsletter_id)
+        .values(
+            clicked=True,
+            click_count=tracking.click_count + 1,
+            last_clicked_at=datetime.utcnow()
+        )
+    )
     
-    if tracking:
-        tracking.clicked = True
-        tracking.click_count += 1
-        tracking.last_clicked_at = datetime.utcnow()
-        
+    if result.rowcount:
         # Record which article was clicked
-        clicked = tracking.clicked_articles.split(",") if tracking.clicked_articles else []
-        clicked.append(str(article_index))
-        tracking.clicked_articles = ",".join(set(clicked))  # Remove duplicates
-        
-        db.commit()
+        db.add(database.EmailTrackingClick(
+            newsletter_id=newsletter_id,
+            article_index=article_index
+        ))
         print(f"📊 Link clicked: {newsletter_id}, Article: {article_index}")
+    else:
+        print(f"⚠️  Click for unknown newsletter: {newsletter_id}, Article: {article_index}")
+    
+    db.commit()
     
     # Redirect to Google search for news articles
     return RedirectResponse(url="https://www.google.com/search?q=news+articles")
@@ -144,6 +248,15 @@ def get_analytics(newsletter_id: str, db: Session = Depends(get_db)):
     if not tracking:
         raise HTTPException(status_code=404, detail="Newsletter not found")
     
+    # Distinct articles clicked, in order of first click
+    clicks = database.EmailTrackingClick
+    clicked_articles = db.execute(
+        select(clicks.article_index)
+        .where(clicks.newsletter_id == newsletter_id)
+        .group_by(clicks.article_index)
+        .order_by(func.min(clicks.id))
+    ).scalars().all()
+    
     return {
         "newsletter_id": tracking.newsletter_id,
         "user_email": tracking.user_email,
@@ -154,19 +267,34 @@ def get_analytics(newsletter_id: str, db: Session = Depends(get_db)):
         "clicked": tracking.clicked,
         "click_count": tracking.click_count,
         "last_clicked_at": tracking.last_clicked_at,
-        "clicked_articles": tracking.clicked_articles.split(",") if tracking.clicked_articles else []
+        "clicked_articles": clicked_articles
     }
 
 
 @app.get("/analytics")
 def get_all_analytics(db: Session = Depends(get_db)):
     """Get analytics for all newsletters"""
-    all_tracking = db.query(database.EmailTracking).all()
+    tracking = database.EmailTracking
+    
+    # Calculate summary stats in one aggregate query
+    total_sent, total_opened, total_clicked = db.execute(
+        select(
+            func.count(tracking.id),
+            func.coalesce(func.sum(case((tracking.opened, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((tracking.clicked, 1), else_=0)), 0)
+        )
+    ).one()
     
-    # Calculate summary stats
-    total_sent = len(all_tracking)
-    total_opened = sum(1 for t in all_tracking if t.opened)
-    total_clicked = sum(1 for t in all_tracking if t.clicked)
+    # Only the columns shown in the detailed list
+    rows = db.execute(
+        select(
+            tracking.newsletter_id,
+            tracking.user_email,
+            tracking.sent_at,
+            tracking.opened,
+            tracking.clicked
+        )
+    ).all()
     
     return {
         "summary": {
@@ -176,12 +304,12 @@ def get_all_analytics(db: Session = Depends(get_db)):
         },
         "detailed": [
             {
-                "newsletter_id": t.newsletter_id,
-                "user_email": t.user_email,
-                "sent_at": t.sent_at,
-                "opened": t.opened,
-                "clicked": t.clicked
+                "newsletter_id": row.newsletter_id,
+                "user_email": row.user_email,
+                "sent_at": row.sent_at,
+                "opened": row.opened,
+                "clicked": row.clicked
             }
-            for t in all_tracking
+            for row in rows
         ]
-    }
\ No newline at end of file
+    }
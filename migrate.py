@@ -0,0 +1,132 @@
+"""
+One-off schema migrations for existing databases
+Run once after upgrading: python migrate.py (safe to re-run)
+"""
+from sqlalchemy import inspect, select, text
+import database
+import json
+
+
+def add_interest_positions(conn):
+    """Add user_interests.position to link tables created before it existed"""
+    columns = {column["name"] for column in inspect(conn).get_columns("user_interests")}
+    if "position" in columns:
+        return
+    
+    conn.execute(text("ALTER TABLE user_interests ADD COLUMN position INTEGER NOT NULL DEFAULT 0"))
+    print("   ➕ Added user_interests.position")
+
+
+def add_tracking_delivered(conn):
+    """Add email_tracking.delivered; rows from before it existed count as delivered"""
+    columns = {column["name"] for column in inspect(conn).get_columns("email_tracking")}
+    if "delivered" in columns:
+        return
+    
+    conn.execute(text("ALTER TABLE email_tracking ADD COLUMN delivered BOOLEAN DEFAULT TRUE"))
+    print("   ➕ Added email_tracking.delivered")
+
+
+def create_missing_indexes(conn):
+    """
+    Create indexes declared on the models but missing from tables that
+    already existed - create_all() skips existing tables entirely
+    """
+    for table in (database.EmailTracking.__table__, database.user_interests):
+        existing = {index["name"] for index in inspect(conn).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn, checkfirst=True)
+                print(f"   ➕ Created index {index.name}")
+
+
+def backfill_interests(conn):
+    """
+    Copy the legacy comma-separated users.interests column into the
+    interests / user_interests tables, keeping each user's order.
+    Users that already have linked interests are left alone.
+    """
+    columns = {column["name"] for column in inspect(conn).get_columns("users")}
+    if "interests" not in columns:
+        print("   ✅ No legacy users.interests column - nothing to backfill")
+        return
+    
+    linked = set(conn.execute(select(database.user_interests.c.user_id).distinct()).scalars())
+    legacy = conn.execute(text("SELECT id, interests FROM users WHERE interests IS NOT NULL")).all()
+    
+    interest_ids = dict(conn.execute(select(database.Interest.name, database.Interest.id)).all())
+    links = []
+    for user_id, raw in legacy:
+        if user_id in linked:
+            continue
+        
+        # Same cleanup as /subscribe: strip, drop blanks, de-duplicate in order
+        names = list(dict.fromkeys(name.strip() for name in raw.split(",") if name.strip()))
+        for position, name in enumerate(names):
+            if name not in interest_ids:
+                interest_ids[name] = conn.execute(
+                    database.Interest.__table__.insert().values(name=name)
+                ).inserted_primary_key[0]
+            links.append({"user_id": user_id, "interest_id": interest_ids[name], "position": position})
+    
+    if links:
+        conn.execute(database.user_interests.insert(), links)
+    print(f"   ✅ Backfilled {len(links)} interests for {len({link['user_id'] for link in links})} users")
+
+
+def backfill_clicks(conn):
+    """
+    Copy the legacy email_tracking.clicked_articles column (a comma-separated
+    string, or a JSON list) into email_tracking_clicks, one row per article.
+    Newsletters that already have click rows are left alone.
+    """
+    columns = {column["name"] for column in inspect(conn).get_columns("email_tracking")}
+    if "clicked_articles" not in columns:
+        print("   ✅ No legacy email_tracking.clicked_articles column - nothing to backfill")
+        return
+    
+    clicks = database.EmailTrackingClick.__table__
+    has_clicks = set(conn.execute(select(clicks.c.newsletter_id).distinct()).scalars())
+    legacy = conn.execute(text(
+        "SELECT newsletter_id, clicked_articles, last_clicked_at FROM email_tracking "
+        "WHERE clicked_articles IS NOT NULL AND clicked_articles != ''"
+    )).all()
+    
+    rows = []
+    for newsletter_id, raw, last_clicked_at in legacy:
+        if newsletter_id in has_clicks:
+            continue
+        
+        raw = raw.strip()
+        values = json.loads(raw) if raw.startswith("[") else raw.split(",")
+        
+        # De-duplicate in order; skip anything that isn't an article index
+        indexes = dict.fromkeys(
+            int(value) for value in (str(value).strip() for value in values) if value.isdigit()
+        )
+        rows.extend(
+            {"newsletter_id": newsletter_id, "article_index": index, "clicked_at": last_clicked_at}
+            for index in indexes
+        )
+    
+    if rows:
+        # Plain SQL so last_clicked_at is copied as stored, whatever the driver returns
+        conn.execute(text(
+            "INSERT INTO email_tracking_clicks (newsletter_id, article_index, clicked_at) "
+            "VALUES (:newsletter_id, :article_index, :clicked_at)"
+        ), rows)
+    print(f"   ✅ Backfilled {len(rows)} clicks for {len({row['newsletter_id'] for row in rows})} newsletters")
+
+
+if __name__ == "__main__":
+    print("🔧 Migrating database...")
+    
+    # One transaction - a failure leaves the database untouched
+    with database.engine.begin() as conn:
+        add_interest_positions(conn)
+        backfill_interests(conn)
+        add_tracking_delivered(conn)
+        backfill_clicks(conn)
+        create_missing_indexes(conn)
+    
+    print("✅ Migration complete")
@@ -5,17 +5,45 @@ import database
 from scraper import NewsScraper
 from ai_summarizer import ArticleSummarizer
 from email_sender import EmailSender
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
-import time
+from itertools import groupby
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait, as_completed, FIRST_COMPLETED
 from datetime import datetime
 import uuid  # For generating newsletter IDs
 
 
+# Users prepared/sent concurrently; scraping, summarizing and sending are
+# network-bound, and the SMTP pool bounds concurrent connections further
+MAX_CONCURRENT_USERS = 8
+
+# Stop the run once failed sends reach max(this, a third of all users)
+MIN_FAILURES_BEFORE_ABORT = 10
+
+# Delivery outcomes are bulk-updated in batches of this size
+TRACKING_FLUSH_SIZE = 100
+
+
 class NewsletterOrchestrator:
-    def __init__(self):
+    # Stateless, so one summarizer is shared by every orchestrator/run
+    summarizer = ArticleSummarizer()
+    
+    def __init__(self, smtp_pool=None):
         self.scraper = NewsScraper()
-        self.summarizer = ArticleSummarizer()
-        self.email_sender = EmailSender()
+        # Optional shared SMTPPool, e.g. when several orchestrators run at once
+        self.email_sender = EmailSender(smtp_pool=smtp_pool)
+        
+        # Per-run caches shared by all users: interest → articles, url → summary
+        self._articles_by_interest = {}
+        self._summaries_by_url = {}
+        self._cache_lock = threading.Lock()
+        
+        # Per-run send outcomes; _abort is set once too many sends fail
+        self.sent_ok = 0
+        self.sent_fail = 0
+        self._max_failures = MIN_FAILURES_BEFORE_ABORT
+        self._abort = threading.Event()
     
     def run_daily_newsletter(self, db: Session):
         """
@@ -23,113 +51,299 @@ class NewsletterOrchestrator:
         """
         print("🚀 Starting daily newsletter pipeline...")
         
-        # 1. Get all subscribed users
-        users = db.query(database.User).filter(database.User.subscribed == True).all()
+        # 1. Get all subscribed users as plain (email, [interests]) pairs
+        # Only the needed columns are selected - no ORM objects - and the
+        # session isn't touched by the worker threads afterwards
+        rows = db.execute(
+            select(database.User.id, database.User.email, database.Interest.name)
+            .select_from(database.User)
+            .outerjoin(database.user_interests, database.user_interests.c.user_id == database.User.id)
+            .outerjoin(database.Interest, database.Interest.id == database.user_interests.c.interest_id)
+            .where(database.User.subscribed == True)
+            .order_by(database.User.id, database.user_interests.c.position)
+        ).all()
+        users = [
+            (email, [interest for _, _, interest in group if interest])
+            for (user_id, email), group in groupby(rows, key=lambda row: (row.id, row.email))
+        ]
         print(f"📋 Found {len(users)} subscribed users")
         
-        for user in users:
-            print(f"\n👤 Processing user: {user.email}")
-            
-            # Parse interests
-            interests = [interest.strip() for interest in user.interests.split(",") if interest.strip()]
-            print(f"   Interests: {interests}")
-            
-            # Skip if no interests
-            if not interests:
-                print("   ⚠️  No interests specified, skipping")
-                continue
+        # Group recipients by domain so consecutive sends hit the same
+        # mail host and its pooled connections stay warm
+        users.sort(key=lambda user: user[0].rpartition("@")[2].lower())
+        
+        # Scrape each interest and summarize each URL once per run
+        self._articles_by_interest = {}
+        self._summaries_by_url = {}
+        
+        # Fail fast when the mail server is down instead of timing out on everyone
+        self.sent_ok = 0
+        self.sent_fail = 0
+        self._max_failures = max(MIN_FAILURES_BEFORE_ABORT, len(users) // 3)
+        self._abort.clear()
+        
+        tracking_saved = 0
+        delivered_ids = []
+        
+        # More send threads than pooled SMTP connections would just block
+        smtp_pool = self.email_sender.smtp_pool
+        send_workers = min(MAX_CONCURRENT_USERS, smtp_pool.max_conns) if smtp_pool else MAX_CONCURRENT_USERS
+        
+        # Keep pooled SMTP connections open for the whole run. Newsletters
+        # are built on one pool and sent on another, so sends start as soon
+        # as each newsletter is ready rather than after every build
+        with self.email_sender, \
+                ThreadPoolExecutor(max_workers=MAX_CONCURRENT_USERS) as build_executor, \
+                ThreadPoolExecutor(max_workers=send_workers) as send_executor:
+            building = {
+                build_executor.submit(self.build_newsletter, email, interests): email
+                for email, interests in users
+            }
+            sending = []
             
-            # 2. Get articles for each interest
-            all_articles = []
-            for interest in interests[:3]:  # Limit to 3 interests max
-                print(f"   📰 Fetching articles for '{interest}'...")
-                articles = self.scraper.get_articles(interest, max_articles=2)
+            while building:
+                done, _ = wait(building, return_when=FIRST_COMPLETED)
                 
-                for article in articles:
-                    # 3. Summarize each article
-                    print(f"      📝 Summarizing: {article['title'][:50]}...")
-                    summary = self.summarizer.summarize_article(
-                        article['title'], 
-                        article['url']
-                    )
-                    
-                    # 4. Personalize summary
-                    personalized_summary = self.summarizer.personalize_summary(
-                        summary, 
-                        interests
+                ready = []
+                for future in done:
+                    email = building.pop(future)
+                    if future.cancelled():
+                        continue
+                    try:
+                        newsletter = future.result()
+                    except Exception as e:
+                        print(f"   ❌ Failed to process {email}: {e}")
+                        continue
+                    if newsletter:
+                        ready.append((email, newsletter))
+                
+                if self._abort.is_set():
+                    # Drop users that haven't started; already-sent rows are kept
+                    for pending in building:
+                        pending.cancel()
+                    continue
+                
+                if not ready:
+                    continue
+                
+                # 8. Tracking rows go in before the emails go out, so an
+                # open/click can never arrive ahead of its row. They start
+                # undelivered and are flipped once the send succeeds
+                tracking_saved += self._save_tracking(db, [
+                    database.EmailTracking(
+                        user_email=email,
+                        newsletter_id=newsletter[0],
+                        sent_at=datetime.utcnow(),
+                        delivered=False
                     )
-                    
-                    all_articles.append({
-                        "title": article['title'],
-                        "summary": personalized_summary,
-                        "url": article['url'],
-                        "source": article.get('source', 'Unknown')
-                    })
-            
-            # Skip if no articles found
-            if not all_articles:
-                print("   ⚠️  No articles found, skipping email")
-                continue
-            
-            # Limit to 5 articles max per email
-            selected_articles = all_articles[:5]
-            print(f"   ✨ Selected {len(selected_articles)} articles for newsletter")
-            
-            # 5. Generate newsletter_id FIRST
-            newsletter_id = str(uuid.uuid4())[:8]
+                    for email, newsletter in ready
+                ])
+                
+                sending.extend(
+                    send_executor.submit(self.send_user_newsletter, email, newsletter)
+                    for email, newsletter in ready
+                )
             
-            # 6. Generate email content WITH newsletter_id
-            html_content = self.email_sender.create_newsletter_html(
-                selected_articles, 
-                interests,
-                newsletter_id=newsletter_id
+            for future in as_completed(sending):
+                try:
+                    newsletter_id, success = future.result()
+                except Exception as e:
+                    print(f"   ❌ Failed to send newsletter: {e}")
+                    continue
+                
+                if success:
+                    delivered_ids.append(newsletter_id)
+                if len(delivered_ids) >= TRACKING_FLUSH_SIZE:
+                    self._mark_delivered(db, delivered_ids)
+                    delivered_ids = []
+        
+        self._mark_delivered(db, delivered_ids)
+        print(f"📊 Tracking records created: {tracking_saved}")
+        
+        print(f"📬 Sent: {self.sent_ok} ok, {self.sent_fail} failed")
+        if self._abort.is_set():
+            print(f"🛑 Run aborted after {self.sent_fail} failed sends - remaining users skipped")
+        print(f"\n✅ Pipeline complete! Processed {len(users)} users.")
+    
+    def build_newsletter(self, email, interests):
+        """
+        Build one user's newsletter (runs in a worker thread)
+        Returns (newsletter_id, subject, html_content, plain_text),
+        or None if the user was skipped
+        """
+        if self._abort.is_set():
+            return None
+        
+        print(f"\n👤 Processing user: {email}")
+        print(f"   Interests: {interests}")
+        
+        # Skip if no interests
+        if not interests:
+            print("   ⚠️  No interests specified, skipping")
+            return None
+        
+        # 2. Get articles for each interest
+        all_articles = []
+        for interest in interests[:3]:  # Limit to 3 interests max
+            print(f"   📰 Fetching articles for '{interest}'...")
+            # Articles without a URL are dropped here, once per interest,
+            # so later steps can rely on article['url']
+            articles = self._cached(
+                self._articles_by_interest, interest,
+                lambda: [
+                    article for article in self.scraper.get_articles(interest, max_articles=2)
+                    if article.get('url')
+                ]
             )
             
-            plain_text = f"Your daily newsletter with {len(selected_articles)} articles about {', '.join(interests[:2])}."
-            
-            # 7. Send email WITH newsletter_id
-            subject = f"Your {interests[0].title()} News Digest"
-            print(f"   📧 Sending email with subject: {subject}")
-            
-            # Send email with pre-generated newsletter_id
-            success, sent_newsletter_id = self.email_sender.send_newsletter(
-                to_email=user.email,
-                subject=subject,
-                html_content=html_content,
-                plain_text=plain_text,
-                newsletter_id=newsletter_id
+            for article in articles:
+                # 3. Summarize each article
+                print(f"      📝 Summarizing: {article['title'][:50]}...")
+                summary = self._cached(
+                    self._summaries_by_url, article['url'],
+                    lambda: self.summarizer.summarize_article(article['title'], article['url'])
+                )
+                
+                # 4. Personalize summary (per user, never cached)
+                personalized_summary = self.summarizer.personalize_summary(
+                    summary, 
+                    interests
+                )
+                
+                all_articles.append({
+                    "title": article['title'],
+                    "summary": personalized_summary,
+                    "url": article['url'],
+                    "source": article.get('source', 'Unknown')
+                })
+        
+        # Skip if no articles found
+        if not all_articles:
+            print("   ⚠️  No articles found, skipping email")
+            return None
+        
+        # Limit to 5 articles max per email
+        selected_articles = all_articles[:5]
+        print(f"   ✨ Selected {len(selected_articles)} articles for newsletter")
+        
+        # 5. Generate newsletter_id FIRST
+        newsletter_id = str(uuid.uuid4())[:8]
+        
+        # 6. Generate email content WITH newsletter_id
+        html_content = self.email_sender.create_newsletter_html(
+            selected_articles, 
+            interests,
+            newsletter_id=newsletter_id,
+            email=email
+        )
+        
+        plain_text = f"Your daily newsletter with {len(selected_articles)} articles about {', '.join(interests[:2])}."
+        
+        subject = f"Your {interests[0].title()} News Digest"
+        print(f"   📊 Articles: {[a['title'][:30] + '...' for a in selected_articles]}")
+        
+        return newsletter_id, subject, html_content, plain_text
+    
+    def send_user_newsletter(self, email, newsletter):
+        """
+        Send one built newsletter (runs in a worker thread)
+        Returns (newsletter_id, success)
+        """
+        newsletter_id, subject, html_content, plain_text = newsletter
+        
+        # Run was aborted while this send was queued
+        if self._abort.is_set():
+            return newsletter_id, False
+        
+        # 7. Send email WITH newsletter_id
+        print(f"   📧 Sending email to {email} with subject: {subject}")
+        success, sent_newsletter_id = self.email_sender.send_newsletter(
+            to_email=email,
+            subject=subject,
+            html_content=html_content,
+            plain_text=plain_text,
+            newsletter_id=newsletter_id
+        )
+        
+        self._record_send(success)
+        
+        print(f"   📬 Sent to {email}, Newsletter ID: {newsletter_id}")
+        
+        return newsletter_id, success
+    
+    def _save_tracking(self, db, rows):
+        """
+        Bulk insert one batch of tracking rows in its own commit.
+        Returns how many were saved (0 if the batch failed).
+        """
+        if not rows:
+            return 0
+        
+        try:
+            db.bulk_save_objects(rows)
+            db.commit()
+            return len(rows)
+        except Exception as e:
+            print(f"⚠️  Failed to create {len(rows)} tracking records: {e}")
+            db.rollback()
+            return 0
+    
+    def _mark_delivered(self, db, newsletter_ids):
+        """Flip delivered=True for one batch of successfully sent newsletters"""
+        if not newsletter_ids:
+            return
+        
+        try:
+            db.execute(
+                update(database.EmailTracking)
+                .where(database.EmailTracking.newsletter_id.in_(newsletter_ids))
+                .values(delivered=True)
             )
+            db.commit()
+        except Exception as e:
+            # Rows stay delivered=False - a retry may resend these
+            print(f"⚠️  Failed to mark {len(newsletter_ids)} newsletters delivered: {e}")
+            db.rollback()
+    
+    def _record_send(self, success):
+        """
+        Count one send outcome; trips the abort flag once failures
+        reach the run's limit so the other workers stop sending
+        """
+        with self._cache_lock:
+            if success:
+                self.sent_ok += 1
+                return
             
-            print(f"   📬 Sent to {user.email}, Newsletter ID: {newsletter_id}")
-            print(f"   📊 Articles: {[a['title'][:30] + '...' for a in selected_articles]}")
-            
-            # 8. Create tracking record in database
+            self.sent_fail += 1
+            if self.sent_fail >= self._max_failures and not self._abort.is_set():
+                print(f"\n🛑 {self.sent_fail} sends failed - aborting newsletter run")
+                self._abort.set()
+    
+    def _cached(self, cache, key, compute):
+        """
+        Return cache[key], calling compute() only once per key even when
+        several worker threads ask for the same key at the same time
+        """
+        with self._cache_lock:
+            future = cache.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = cache[key] = Future()
+        
+        if is_owner:
             try:
-                tracking_record = database.EmailTracking(
-                    user_email=user.email,
-                    newsletter_id=newsletter_id,
-                    sent_at=datetime.utcnow()
-                )
-                db.add(tracking_record)
-                db.commit()
-                print(f"   📊 Tracking record created: {newsletter_id}")
+                future.set_result(compute())
             except Exception as e:
-                print(f"   ⚠️  Failed to create tracking record: {e}")
-                db.rollback()
-            
-            # Small delay to avoid rate limits
-            time.sleep(0.5)
+                future.set_exception(e)
         
-        print(f"\n✅ Pipeline complete! Processed {len(users)} users.")
+        return future.result()
 
 
 # Manual trigger
 if __name__ == "__main__":
     # Create database session
-    from sqlalchemy.orm import sessionmaker
-    engine = database.create_engine(database.os.getenv("DATABASE_URL"))
-    SessionLocal = sessionmaker(bind=engine)
-    db = SessionLocal()
+    db = database.SessionLocal()
     
     # Run orchestrator
     orchestrator = NewsletterOrchestrator()
@@ -5,8 +5,6 @@ import schedule
 import time
 from orchestrator import NewsletterOrchestrator
 import database
-from sqlalchemy.orm import sessionmaker
-import os
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,10 +15,8 @@ def run_newsletter_job():
     print(f"\n{'='*60}")
     print(f"🕒 Running scheduled newsletter job at {time.strftime('%Y-%m-%d %H:%M:%S')}")
     
-    # Create database session
-    engine = database.create_engine(os.getenv("DATABASE_URL"))
-    SessionLocal = sessionmaker(bind=engine)
-    db = SessionLocal()
+    # Create database session from the shared, pooled engine
+    db = database.SessionLocal()
     
     try:
         # Run orchestrator
@@ -46,7 +42,10 @@ if __name__ == "__main__":
     print("Running initial test...")
     run_newsletter_job()
     
-    # Keep scheduler running
+    # Keep scheduler running - sleep straight through to the next due job
     while True:
         schedule.run_pending()
-        time.sleep(60)  # Check every minute
\ No newline at end of file
+        delay = schedule.idle_seconds()
+        if delay is None:
+            break  # Nothing left scheduled
+        time.sleep(max(delay, 0))
\ No newline at end of file
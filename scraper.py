@@ -2,8 +2,19 @@
 Web scraper for fetching articles
 """
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
 import random
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# Only headline tags are ever inspected, so only those get parsed into the tree
+HEADLINE_TAGS = ['h2', 'h3', 'h4']
+_HEADLINE_STRAINER = SoupStrainer(HEADLINE_TAGS)
+
+SCRAPE_WORKERS = 8      # Source sites fetched at once
+SCRAPE_TIMEOUT = 12     # Seconds to wait for one source's results
 
 
 class NewsScraper:
@@ -23,19 +34,39 @@ class NewsScraper:
                 "https://www.economist.com/"
             ]
         }
+        
+        # One session for every scrape so users/interests reuse
+        # keep-alive connections instead of a new TCP+TLS handshake each time
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=16,
+            max_retries=Retry(total=2, backoff_factor=0.3)
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        })
+        
+        # Scraper per site hostname - add more sources here later
+        self.scrapers = {
+            "techcrunch.com": self.scrape_techcrunch,
+        }
+        
+        # Sources for an interest are fetched in parallel (network-bound)
+        self._executor = ThreadPoolExecutor(max_workers=SCRAPE_WORKERS)
     
     def scrape_techcrunch(self, url):
         """Scrape TechCrunch for article titles"""
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            soup = BeautifulSoup(response.text, 'html.parser')
+            response = self.session.get(url, timeout=10)
+            # Bytes straight to lxml - it sniffs the encoding itself
+            soup = BeautifulSoup(response.content, 'lxml', parse_only=_HEADLINE_STRAINER)
             
             articles = []
             # Try different selectors
-            for headline in soup.find_all(['h2', 'h3', 'h4'])[:10]:
+            for headline in soup.find_all(HEADLINE_TAGS, limit=10):
                 title = headline.get_text(strip=True)
                 if len(title) > 20:  # Filter out short/navigation items
                     link = headline.find('a')
@@ -55,6 +86,17 @@ class NewsScraper:
             print(f"Error scraping {url}: {e}")
             return []
     
+    def _scrape_one(self, url):
+        """Scrape one source URL with the scraper for its site, if any"""
+        hostname = urlparse(url).hostname or ""
+        if hostname.startswith("www."):
+            hostname = hostname[4:]
+        
+        scrape = self.scrapers.get(hostname)
+        if scrape is None:
+            return []
+        return scrape(url)
+    
     def get_articles(self, interest, max_articles=3):
         """
         Get articles for a specific interest
@@ -63,12 +105,18 @@ class NewsScraper:
         if interest not in self.sources:
             return []
         
+        # Fetch all sources at once - total time is the slowest site, not the sum
+        futures = [
+            (source_url, self._executor.submit(self._scrape_one, source_url))
+            for source_url in self.sources[interest]
+        ]
+        
         articles = []
-        for source_url in self.sources[interest]:
-            if "techcrunch" in source_url:
-                articles.extend(self.scrape_techcrunch(source_url))
-            
-            # Add more sources here later
+        for source_url, future in futures:
+            try:
+                articles.extend(future.result(timeout=SCRAPE_TIMEOUT))
+            except TimeoutError:
+                print(f"Timed out scraping {source_url}")
         
         # Return random selection (or all if less than max)
         if len(articles) > max_articles: